@@ -1,12 +1,18 @@
 import os
+import functools
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
 from datetime import datetime, timedelta, timezone
-from typing import Optional
-from fastapi import Depends, HTTPException, status
+from typing import Deque, Dict, Optional, Tuple
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from . import database, models, schemas, crud
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import database, models, schemas, crud, cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,23 +20,129 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Cost factor for new hashes. 10 keeps a verification around 50-100ms on
+# typical server CPUs; existing hashes keep verifying at their own cost.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 10))
 
 if not SECRET_KEY or not ALGORITHM:
     raise ValueError("SECRET_KEY and ALGORITHM must be set in .env")
 
 # Password hashing setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@functools.lru_cache(maxsize=None)
+def get_pwd_context() -> CryptContext:
+    """Builds the CryptContext on first use rather than at import time."""
+    return CryptContext(
+        schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS, deprecated="auto"
+    )
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies a plain password against a hashed one."""
-    return pwd_context.verify(plain_password, hashed_password)
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+# --- Login verification cache ---
+# bcrypt is deliberately slow, so successful checks are remembered for a
+# short while and repeated logins with the same credentials skip it.
+# Failures are never cached. The key includes the stored hash, so a
+# password change invalidates old entries, and the password itself is
+# only kept as an HMAC.
+VERIFY_CACHE_SIZE = int(os.getenv("VERIFY_CACHE_SIZE", 1024))
+VERIFY_CACHE_TTL = int(os.getenv("VERIFY_CACHE_TTL", 60))  # seconds
+
+_verify_cache: "OrderedDict[Tuple[int, str, bytes], float]" = OrderedDict()
+_verify_cache_lock = threading.Lock()
+
+def authenticate_password(user: models.User, plain_password: str) -> bool:
+    """Verifies a user's password, using the cache of recent successes."""
+    digest = hmac.new(
+        SECRET_KEY.encode(), plain_password.encode(), hashlib.sha256
+    ).digest()
+    key = (user.id, user.hashed_password, digest)
+    now = time.monotonic()
+
+    with _verify_cache_lock:
+        expires_at = _verify_cache.get(key)
+        if expires_at is not None:
+            if expires_at > now:
+                _verify_cache.move_to_end(key)
+                return True
+            del _verify_cache[key]
+
+    if not verify_password(plain_password, user.hashed_password):
+        return False
+
+    with _verify_cache_lock:
+        _verify_cache[key] = now + VERIFY_CACHE_TTL
+        _verify_cache.move_to_end(key)
+        while len(_verify_cache) > VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+    return True
 
 def get_password_hash(password: str) -> str:
     """Hashes a plain password."""
-    return pwd_context.hash(password)
+    return get_pwd_context().hash(password)
+
+# --- Login rate limiting ---
+# Sliding windows of *failed* attempts, kept in process memory. Successful
+# logins don't count. The per-(client IP, email) limit means users behind
+# one shared IP can't lock each other out; the coarser per-IP ceiling
+# stops one client from spraying guesses across many emails, each of
+# which would cost a bcrypt check.
+LOGIN_RATE_LIMIT = int(os.getenv("LOGIN_RATE_LIMIT", 10))
+LOGIN_IP_RATE_LIMIT = int(os.getenv("LOGIN_IP_RATE_LIMIT", 50))
+LOGIN_RATE_WINDOW = int(os.getenv("LOGIN_RATE_WINDOW", 60))  # seconds
+
+_failed_logins: Dict[Tuple[str, ...], Deque[float]] = defaultdict(deque)
+_failed_logins_lock = threading.Lock()
+
+def _login_keys(request: Request, email: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Returns the per-IP and per-(IP, email) counter keys."""
+    client_ip = request.client.host if request.client else "unknown"
+    return (client_ip,), (client_ip, email.lower())
+
+def _recent_failures(key: Tuple[str, ...], window_start: float) -> int:
+    # Caller holds _failed_logins_lock
+    attempts = _failed_logins.get(key)
+    if attempts is None:
+        return 0
+    while attempts and attempts[0] <= window_start:
+        attempts.popleft()
+    if not attempts:
+        del _failed_logins[key]
+        return 0
+    return len(attempts)
+
+def check_login_rate_limit(request: Request, email: str) -> None:
+    """Rejects a login when this client has failed too often."""
+    ip_key, email_key = _login_keys(request, email)
+    window_start = time.monotonic() - LOGIN_RATE_WINDOW
+
+    with _failed_logins_lock:
+        if (
+            _recent_failures(ip_key, window_start) >= LOGIN_IP_RATE_LIMIT
+            or _recent_failures(email_key, window_start) >= LOGIN_RATE_LIMIT
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many failed login attempts, try again later",
+                headers={"Retry-After": str(LOGIN_RATE_WINDOW)},
+            )
+
+def record_failed_login(request: Request, email: str) -> None:
+    """Counts a failed login towards the client's limits."""
+    now = time.monotonic()
+    window_start = now - LOGIN_RATE_WINDOW
+
+    with _failed_logins_lock:
+        for key in _login_keys(request, email):
+            _failed_logins[key].append(now)
+
+        # Forget clients that have gone quiet so the table stays small
+        if len(_failed_logins) > 10000:
+            for key in [k for k, a in _failed_logins.items() if a[-1] <= window_start]:
+                del _failed_logins[key]
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Creates a new JWT access token."""
@@ -43,6 +155,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
 def verify_token(token: str, credentials_exception) -> schemas.TokenData:
     """Decodes and validates a JWT."""
     try:
@@ -55,21 +174,40 @@ def verify_token(token: str, credentials_exception) -> schemas.TokenData:
         raise credentials_exception
     return token_data
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme), 
-    db: Session = Depends(database.get_db)
+    db: AsyncSession = Depends(database.get_db)
 ) -> models.User:
     """
     FastAPI dependency to get the current authenticated user.
     This protects endpoints.
     """
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+    credentials_exception = _credentials_exception()
     token_data = verify_token(token, credentials_exception)
-    user = crud.get_user_by_email(db, email=token_data.email)
+    user = await crud.get_user_by_email(db, email=token_data.email)
+    if user is None:
+        raise credentials_exception
+    return user
+
+async def get_current_user_profile(
+    token: str = Depends(oauth2_scheme), 
+    db: AsyncSession = Depends(database.get_db)
+) -> schemas.User:
+    """
+    Like get_current_user, but returns the public profile and serves it
+    from the cache when possible, skipping the database lookup.
+    """
+    credentials_exception = _credentials_exception()
+    token_data = verify_token(token, credentials_exception)
+    key = cache.user_key(token_data.email)
+
+    cached_profile = await cache.get_value(key)
+    if cached_profile is not None:
+        return schemas.User.model_validate_json(cached_profile)
+
+    user = await crud.get_user_by_email(db, email=token_data.email)
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    profile = schemas.User.model_validate(user)
+    await cache.set_value(key, profile.model_dump_json(), cache.USER_CACHE_TTL)
+    return profile
\ No newline at end of file
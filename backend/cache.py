@@ -0,0 +1,95 @@
+import functools
+import inspect
+import logging
+import os
+from typing import Any, Callable, Optional, Union
+import orjson
+from pydantic import TypeAdapter
+from redis import asyncio as redis
+from redis.exceptions import RedisError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Caching is optional: without REDIS_URL every lookup is a miss and every
+# write is a no-op, so the app behaves exactly as it would uncached.
+REDIS_URL = os.getenv("REDIS_URL")
+MARKETPLACE_CACHE_TTL = int(os.getenv("MARKETPLACE_CACHE_TTL", 30))  # seconds
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 300))  # seconds
+
+client: Optional[redis.Redis] = redis.from_url(REDIS_URL) if REDIS_URL else None
+
+async def get_value(key: str) -> Optional[bytes]:
+    """Returns the cached value for key, or None on a miss."""
+    if client is None:
+        return None
+    try:
+        return await client.get(key)
+    except RedisError:
+        # A broken cache must never break the request; fall back to the DB
+        logger.warning("Cache read failed for %s", key, exc_info=True)
+        return None
+
+async def set_value(key: str, value: Union[bytes, str], ttl: int) -> None:
+    """Stores value under key for ttl seconds."""
+    if client is None:
+        return
+    try:
+        await client.set(key, value, ex=ttl)
+    except RedisError:
+        logger.warning("Cache write failed for %s", key, exc_info=True)
+
+# --- Namespaces ---
+# Keys in a namespace embed its current generation number, so a whole
+# namespace is invalidated with one INCR instead of scanning for keys;
+# entries from older generations simply expire.
+
+async def _generation(namespace: str) -> int:
+    value = await get_value(f"{namespace}:gen")
+    return int(value) if value is not None else 0
+
+async def invalidate(namespace: str) -> None:
+    """Drops every cached entry in namespace."""
+    if client is None:
+        return
+    try:
+        await client.incr(f"{namespace}:gen")
+    except RedisError:
+        logger.warning("Cache invalidation failed for %s", namespace, exc_info=True)
+
+def cached(namespace: str, key_template: str, ttl: int, adapter: TypeAdapter) -> Callable:
+    """
+    Cache-aside decorator for async functions.
+    key_template is formatted with the call's arguments by name. The result
+    is stored as JSON and decoded on a hit with adapter, so callers get the
+    same types whether or not the value came from the cache.
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> Any:
+            arguments = signature.bind(*args, **kwargs).arguments
+            generation = await _generation(namespace)
+            key = f"{namespace}:{generation}:" + key_template.format(**arguments)
+
+            hit = await get_value(key)
+            if hit is not None:
+                return adapter.validate_json(hit)
+
+            result = await func(*args, **kwargs)
+            await set_value(key, orjson.dumps(result), ttl)
+            return result
+        return wrapper
+    return decorator
+
+# --- Keys ---
+
+def user_key(email: str) -> str:
+    return f"user:{email}"
+
+async def invalidate_marketplace() -> None:
+    """Drops every user's cached marketplace feed."""
+    await invalidate("marketplace")
@@ -1,60 +1,89 @@
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import and_, or_
-from . import models, schemas, auth
+import asyncio
+import logging
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from sqlalchemy import and_, or_, bindparam, case, select, text, update
+from . import models, schemas, auth, cache, database
 from fastapi import HTTPException, status
-from typing import List
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Statements on the hot read paths are built once at import time and take
+# their values as bound parameters, so each call skips statement
+# construction and hits the engine's compiled cache directly.
 
 # --- User CRUD ---
 
-def get_user(db: Session, user_id: int) -> models.User:
+_user_by_email = select(models.User).where(
+    models.User.email == bindparam("email")
+)
+
+async def get_user(db: AsyncSession, user_id: int) -> models.User:
     """Get a single user by ID."""
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return await db.get(models.User, user_id)
 
-def get_user_by_email(db: Session, email: str) -> models.User:
+async def get_user_by_email(db: AsyncSession, email: str) -> models.User:
     """Get a single user by email."""
-    return db.query(models.User).filter(models.User.email == email).first()
+    return await db.scalar(_user_by_email, {"email": email})
 
-def create_user(db: Session, user: schemas.UserCreate) -> models.User:
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.User:
     """Create a new user."""
-    hashed_password = auth.get_password_hash(user.password)
+    # bcrypt is CPU-bound; keep it off the event loop
+    hashed_password = await run_in_threadpool(auth.get_password_hash, user.password)
     db_user = models.User(
         email=user.email,
         name=user.name,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 # --- Event CRUD ---
 
-def get_events_by_user(db: Session, user_id: int) -> List[models.Event]:
-    """Get all events for a specific user."""
-    return db.query(models.Event).filter(
-        models.Event.owner_id == user_id
-    ).order_by(models.Event.start_time).all()
+_events_by_owner = select(
+    models.Event.id,
+    models.Event.title,
+    models.Event.start_time,
+    models.Event.end_time,
+    models.Event.status,
+    models.Event.owner_id,
+).where(
+    models.Event.owner_id == bindparam("user_id")
+).order_by(models.Event.start_time)
 
-def get_event(db: Session, event_id: int) -> models.Event:
+async def get_events_by_user(db: AsyncSession, user_id: int) -> List[schemas.EventRow]:
+    """
+    Get all events for a specific user.
+    Returns plain rows, ready to serialize.
+    """
+    rows = await db.execute(_events_by_owner, {"user_id": user_id})
+    return [dict(row._mapping) for row in rows]
+
+async def get_event(db: AsyncSession, event_id: int) -> models.Event:
     """Get a single event by its ID."""
-    return db.query(models.Event).filter(models.Event.id == event_id).first()
+    return await db.get(models.Event, event_id)
 
-def create_event(db: Session, event: schemas.EventCreate, user_id: int) -> models.Event:
+async def create_event(db: AsyncSession, event: schemas.EventCreate, user_id: int) -> models.Event:
     """Create a new event for a user."""
     db_event = models.Event(**event.model_dump(), owner_id=user_id)
     db.add(db_event)
-    db.commit()
-    db.refresh(db_event)
+    await db.commit()
+    await db.refresh(db_event)
     return db_event
 
-def update_event(
-    db: Session, 
+async def update_event(
+    db: AsyncSession, 
     event_id: int, 
     event_data: schemas.EventUpdate, 
     user_id: int
 ) -> models.Event:
     """Update an event's details."""
-    db_event = get_event(db, event_id)
+    db_event = await get_event(db, event_id)
     
     if not db_event:
         return None
@@ -64,17 +93,35 @@ def update_event(
             detail="Not authorized to update this event"
         )
     
+    was_swappable = db_event.status == models.EventStatus.SWAPPABLE
     update_data = event_data.model_dump(exclude_unset=True)
+
+    # A pending slot's status belongs to its swap request until that is
+    # answered; changing it would let the slot be offered twice
+    if (
+        db_event.status == models.EventStatus.SWAP_PENDING
+        and update_data.get("status", db_event.status) != db_event.status
+    ):
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            "Cannot change the status of a slot with a pending swap"
+        )
     for key, value in update_data.items():
         setattr(db_event, key, value)
+
+    marketplace_changed = (
+        was_swappable or db_event.status == models.EventStatus.SWAPPABLE
+    )
         
-    db.commit()
-    db.refresh(db_event)
+    await db.commit()
+    if marketplace_changed:
+        request_marketplace_refresh()
+    await db.refresh(db_event)
     return db_event
 
-def delete_event(db: Session, event_id: int, user_id: int) -> models.Event:
+async def delete_event(db: AsyncSession, event_id: int, user_id: int) -> models.Event:
     """Delete an event."""
-    db_event = get_event(db, event_id)
+    db_event = await get_event(db, event_id)
     
     if not db_event:
         return None
@@ -84,38 +131,104 @@ def delete_event(db: Session, event_id: int, user_id: int) -> models.Event:
             detail="Not authorized to delete this event"
         )
     
-    db.delete(db_event)
-    db.commit()
+    await db.delete(db_event)
+    await db.commit()
+    if db_event.status == models.EventStatus.SWAPPABLE:
+        request_marketplace_refresh()
     return db_event
 
 # --- Marketplace CRUD ---
 
-def get_marketplace_slots(db: Session, user_id: int) -> List[schemas.MarketplaceSlot]:
-    """Get all events from *other* users that are SWAPPABLE."""
-    slots = db.query(models.Event).join(models.User).filter(
-        models.Event.status == models.EventStatus.SWAPPABLE,
-        models.Event.owner_id != user_id
-    ).options(joinedload(models.Event.owner)).all()
-    
-    # Manually construct the response to include owner_name
-    return [
-        schemas.MarketplaceSlot(
-            **event.__dict__,
-            owner_name=event.owner.name
-        ) for event in slots
-    ]
+# Reads the pre-joined view instead of joining events and users per call
+_marketplace_for_user = select(models.marketplace_slots).where(
+    models.marketplace_slots.c.owner_id != bindparam("user_id")
+)
+
+# Writes only mark the view stale; a single background task per worker
+# rebuilds it. Any number of writes that land while a refresh is queued
+# or running collapse into one more refresh, and no request ever waits
+# on the view.
+MARKETPLACE_REFRESH_DELAY = 0.5  # seconds to gather writes before refreshing
+
+_marketplace_stale = asyncio.Event()
+
+def request_marketplace_refresh() -> None:
+    """Marks the marketplace view stale; call after committing the change."""
+    _marketplace_stale.set()
+
+async def _refresh_marketplace() -> None:
+    """
+    Rebuild the marketplace_slots view and drop cached feeds.
+    An advisory lock lets one worker refresh at a time, and since the
+    REFRESH statement only starts once that lock is held, its snapshot
+    includes every write committed before it.
+    """
+    async with database.engine.begin() as conn:
+        # Refreshing may outlast the per-statement timeout meant for requests
+        await conn.execute(text("SET LOCAL statement_timeout = 0"))
+        await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('marketplace_slots'))"))
+        await conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY marketplace_slots"))
+    await cache.invalidate_marketplace()
+
+async def run_marketplace_refresher() -> None:
+    """Background task: refreshes the marketplace view whenever it is stale."""
+    while True:
+        await _marketplace_stale.wait()
+        await asyncio.sleep(MARKETPLACE_REFRESH_DELAY)
+        # Clear before refreshing: writes committed from here on set the
+        # flag again and get a refresh of their own
+        _marketplace_stale.clear()
+        try:
+            await _refresh_marketplace()
+        except Exception:
+            # Keep the task alive; the writes are committed, so retry shortly
+            logger.exception("Refreshing marketplace_slots failed")
+            _marketplace_stale.set()
+            await asyncio.sleep(MARKETPLACE_REFRESH_DELAY)
+
+@cache.cached(
+    "marketplace", "{user_id}",
+    ttl=cache.MARKETPLACE_CACHE_TTL,
+    adapter=TypeAdapter(List[schemas.MarketplaceRow])
+)
+async def get_marketplace_slots(db: AsyncSession, user_id: int) -> List[schemas.MarketplaceRow]:
+    """
+    Get all events from *other* users that are SWAPPABLE.
+    Returns plain rows, ready to serialize.
+    """
+    rows = await db.execute(_marketplace_for_user, {"user_id": user_id})
+    return [dict(row._mapping) for row in rows]
 
 # --- Swap Request CRUD ---
 
-def create_swap_request(
-    db: Session, 
+async def _lock_events(db: AsyncSession, *event_ids: int) -> Dict[int, models.Event]:
+    """
+    Load events with SELECT ... FOR UPDATE, keyed by ID.
+    Rows are locked in ID order so concurrent swaps can't deadlock.
+    """
+    stmt = select(models.Event).where(
+        models.Event.id.in_(event_ids)
+    ).order_by(models.Event.id).with_for_update().execution_options(
+        populate_existing=True
+    )
+    return {event.id: event for event in await db.scalars(stmt)}
+
+async def create_swap_request(
+    db: AsyncSession, 
     request_data: schemas.SwapRequestCreate, 
     requester_id: int
-) -> models.SwapRequest:
-    """Create a new swap request."""
+) -> Tuple[models.SwapRequest, models.Event, models.Event, models.User]:
+    """
+    Create a new swap request.
+    Returns the request along with both slots and the responder, so the
+    caller can build the detailed view without re-querying.
+    """
     
-    my_slot = get_event(db, request_data.my_slot_id)
-    their_slot = get_event(db, request_data.their_slot_id)
+    # Lock both slots so a concurrent request can't claim them between
+    # the checks below and our commit
+    slots = await _lock_events(db, request_data.my_slot_id, request_data.their_slot_id)
+    my_slot = slots.get(request_data.my_slot_id)
+    their_slot = slots.get(request_data.their_slot_id)
 
     # Validations
     if not my_slot or not their_slot:
@@ -124,6 +237,8 @@ def create_swap_request(
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Cannot trade slot you don't own")
     if their_slot.owner_id == requester_id:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Cannot trade with yourself")
+    if my_slot.status == models.EventStatus.SWAP_PENDING:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Your slot is already in a pending swap")
     if their_slot.status != models.EventStatus.SWAPPABLE:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Target slot is not swappable")
     
@@ -139,76 +254,114 @@ def create_swap_request(
     # Set both slots to SWAP_PENDING
     my_slot.status = models.EventStatus.SWAP_PENDING
     their_slot.status = models.EventStatus.SWAP_PENDING
+
+    responder = await get_user(db, their_slot.owner_id)
     
     db.add(db_request)
-    db.commit()
-    db.refresh(db_request)
-    return db_request
+    await db.commit()
+    request_marketplace_refresh()
+    await db.refresh(db_request)
+    return db_request, my_slot, their_slot, responder
+
+def build_swap_request_details(
+    req: models.SwapRequest,
+    requester: models.User,
+    responder: models.User,
+    my_slot: models.Event,
+    their_slot: models.Event
+) -> schemas.SwapRequestDetails:
+    """Build the detailed view of a swap request from already-loaded objects."""
+    return schemas.SwapRequestDetails(
+        id=req.id,
+        status=req.status,
+        created_at=req.created_at,
+        requester_id=requester.id,
+        requester_name=requester.name,
+        responder_id=responder.id,
+        responder_name=responder.name,
+        my_slot_id=my_slot.id,
+        my_slot_title=my_slot.title,
+        my_slot_start=my_slot.start_time,
+        my_slot_end=my_slot.end_time,
+        their_slot_id=their_slot.id,
+        their_slot_title=their_slot.title,
+        their_slot_start=their_slot.start_time,
+        their_slot_end=their_slot.end_time,
+    )
+
+def _swap_request_details_stmt():
+    """
+    Selects exactly the columns SwapRequestDetails needs in one joined
+    query, so neither ORM objects nor Pydantic models are built.
+    """
+    Requester = aliased(models.User)
+    Responder = aliased(models.User)
+    MySlot = aliased(models.Event)
+    TheirSlot = aliased(models.Event)
+    SwapRequest = models.SwapRequest
+
+    return select(
+        SwapRequest.id,
+        SwapRequest.status,
+        SwapRequest.created_at,
+        SwapRequest.requester_id,
+        Requester.name.label("requester_name"),
+        SwapRequest.responder_id,
+        Responder.name.label("responder_name"),
+        SwapRequest.my_slot_id,
+        MySlot.title.label("my_slot_title"),
+        MySlot.start_time.label("my_slot_start"),
+        MySlot.end_time.label("my_slot_end"),
+        SwapRequest.their_slot_id,
+        TheirSlot.title.label("their_slot_title"),
+        TheirSlot.start_time.label("their_slot_start"),
+        TheirSlot.end_time.label("their_slot_end"),
+    ).join(
+        Requester, SwapRequest.requester_id == Requester.id
+    ).join(
+        Responder, SwapRequest.responder_id == Responder.id
+    ).join(
+        MySlot, SwapRequest.my_slot_id == MySlot.id
+    ).join(
+        TheirSlot, SwapRequest.their_slot_id == TheirSlot.id
+    ).order_by(SwapRequest.created_at.desc())
+
+_incoming_requests = _swap_request_details_stmt().where(
+    models.SwapRequest.responder_id == bindparam("user_id")
+)
+_outgoing_requests = _swap_request_details_stmt().where(
+    models.SwapRequest.requester_id == bindparam("user_id")
+)
 
-def _get_swap_request_details(db: Session, query) -> List[schemas.SwapRequestDetails]:
-    """Helper to format swap request responses."""
-    requests = query.all()
-    results = []
-    for req in requests:
-        results.append(schemas.SwapRequestDetails(
-            id=req.id,
-            status=req.status,
-            created_at=req.created_at,
-            requester_id=req.requester.id,
-            requester_name=req.requester.name,
-            responder_id=req.responder.id,
-            responder_name=req.responder.name,
-            my_slot_id=req.my_slot.id,
-            my_slot_title=req.my_slot.title,
-            my_slot_start=req.my_slot.start_time,
-            my_slot_end=req.my_slot.end_time,
-            their_slot_id=req.their_slot.id,
-            their_slot_title=req.their_slot.title,
-            their_slot_start=req.their_slot.start_time,
-            their_slot_end=req.their_slot.end_time,
-        ))
-    return results
-
-def get_incoming_requests(db: Session, user_id: int) -> List[schemas.SwapRequestDetails]:
+async def _get_swap_request_details(db: AsyncSession, stmt, user_id: int) -> List[schemas.SwapRow]:
+    """Helper to format swap request responses as plain rows."""
+    rows = await db.execute(stmt, {"user_id": user_id})
+    return [dict(row._mapping) for row in rows]
+
+async def get_incoming_requests(db: AsyncSession, user_id: int) -> List[schemas.SwapRow]:
     """Get all swap requests sent *to* the user."""
-    query = db.query(models.SwapRequest).filter(
-        models.SwapRequest.responder_id == user_id
-    ).options(
-        joinedload(models.SwapRequest.requester),
-        joinedload(models.SwapRequest.responder),
-        joinedload(models.SwapRequest.my_slot),
-        joinedload(models.SwapRequest.their_slot)
-    ).order_by(models.SwapRequest.created_at.desc())
-    
-    return _get_swap_request_details(db, query)
+    return await _get_swap_request_details(db, _incoming_requests, user_id)
 
-def get_outgoing_requests(db: Session, user_id: int) -> List[schemas.SwapRequestDetails]:
+async def get_outgoing_requests(db: AsyncSession, user_id: int) -> List[schemas.SwapRow]:
     """Get all swap requests sent *by* the user."""
-    query = db.query(models.SwapRequest).filter(
-        models.SwapRequest.requester_id == user_id
-    ).options(
-        joinedload(models.SwapRequest.requester),
-        joinedload(models.SwapRequest.responder),
-        joinedload(models.SwapRequest.my_slot),
-        joinedload(models.SwapRequest.their_slot)
-    ).order_by(models.SwapRequest.created_at.desc())
-    
-    return _get_swap_request_details(db, query)
+    return await _get_swap_request_details(db, _outgoing_requests, user_id)
 
-def get_swap_request(db: Session, request_id: int) -> models.SwapRequest:
+async def get_swap_request(db: AsyncSession, request_id: int) -> models.SwapRequest:
     """Get a single swap request by ID."""
-    return db.query(models.SwapRequest).filter(
-        models.SwapRequest.id == request_id
-    ).first()
+    return await db.get(models.SwapRequest, request_id)
 
-def respond_to_swap_request(
-    db: Session, 
+async def respond_to_swap_request(
+    db: AsyncSession, 
     request_id: int, 
     accept: bool, 
     user_id: int
 ) -> models.SwapRequest:
     """Accept or reject a swap request."""
-    db_request = get_swap_request(db, request_id)
+    # Lock the request row so two concurrent responses can't both see PENDING
+    db_request = await db.get(
+        models.SwapRequest, request_id,
+        with_for_update=True, populate_existing=True
+    )
 
     if not db_request:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Request not found")
@@ -217,29 +370,78 @@ def respond_to_swap_request(
     if db_request.status != models.SwapStatus.PENDING:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Request already actioned")
 
-    my_slot = db_request.my_slot
-    their_slot = db_request.their_slot
+    # The request row lock above serializes responses; each branch below
+    # is a single UPDATE covering both slots, which locks them in turn.
+    # It only matches slots still pending and still owned as they were
+    # when the request was made, so a slot can never change hands twice.
+    Event = models.Event
+    slot_ids = (db_request.my_slot_id, db_request.their_slot_id)
+    slots_unchanged = and_(
+        Event.status == models.EventStatus.SWAP_PENDING,
+        or_(
+            and_(Event.id == db_request.my_slot_id,
+                 Event.owner_id == db_request.requester_id),
+            and_(Event.id == db_request.their_slot_id,
+                 Event.owner_id == db_request.responder_id),
+        )
+    )
 
     if accept:
         # 1. Update request status
-        db_request.status = models.SwapStatus.ACCEPTED
-        
-        # 2. Swap owners
-        their_slot.owner_id = db_request.requester_id
-        my_slot.owner_id = db_request.responder_id
-        
-        # 3. Set both slots to BUSY
-        their_slot.status = models.EventStatus.BUSY
-        my_slot.status = models.EventStatus.BUSY
+        new_status = models.SwapStatus.ACCEPTED
+
+        # 2. Swap owners and 3. set both slots to BUSY
+        result = await db.execute(
+            update(Event).where(slots_unchanged).values(
+                owner_id=case(
+                    (Event.id == db_request.my_slot_id, db_request.responder_id),
+                    else_=db_request.requester_id
+                ),
+                status=models.EventStatus.BUSY
+            ).execution_options(synchronize_session=False)
+        )
+        if result.rowcount != len(slot_ids):
+            await db.rollback()
+            raise HTTPException(
+                status.HTTP_409_CONFLICT, "Slots changed since the request was made"
+            )
         
     else:
         # 1. Update request status
-        db_request.status = models.SwapStatus.REJECTED
+        new_status = models.SwapStatus.REJECTED
         
-        # 2. Revert slots to SWAPPABLE (or BUSY, SWAPPABLE is better)
-        their_slot.status = models.EventStatus.SWAPPABLE
-        my_slot.status = models.EventStatus.SWAPPABLE
+        # 2. Revert slots to SWAPPABLE (or BUSY, SWAPPABLE is better),
+        # leaving alone any slot that has since moved on
+        await db.execute(
+            update(Event).where(slots_unchanged).values(
+                status=models.EventStatus.SWAPPABLE
+            ).execution_options(synchronize_session=False)
+        )
+
+    # Synchronized onto db_request in memory, so no refresh is needed
+    await db.execute(
+        update(models.SwapRequest).where(
+            models.SwapRequest.id == db_request.id
+        ).values(status=new_status)
+    )
+
+    await db.commit()
+    # Rejecting puts both slots back on the marketplace. Accepting only
+    # moves pending slots to BUSY, but refresh anyway so the view can't
+    # drift if that invariant is ever loosened.
+    request_marketplace_refresh()
+    return db_request
+
+# --- Startup ---
 
-    db.commit()
-    db.refresh(db_request)
-    return db_request
\ No newline at end of file
+async def warm_statement_cache(db: AsyncSession) -> None:
+    """
+    Runs each hot read statement once with a parameter that matches nothing,
+    so its compiled form is cached before the first real request arrives.
+    """
+    await db.execute(_user_by_email, {"email": ""})
+    for stmt in (
+        _events_by_owner, _marketplace_for_user,
+        _incoming_requests, _outgoing_requests
+    ):
+        await db.execute(stmt, {"user_id": 0})
@@ -1,20 +1,65 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+import asyncio
+from contextlib import asynccontextmanager, suppress
+import orjson
+from fastapi import FastAPI, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session, joinedload
+from fastapi import responses
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from typing import List
 
 from . import crud, models, schemas, auth, database
 
-# Create all database tables (if they don't exist)
-# In a real production app, you'd use Alembic for migrations.
-models.Base.metadata.create_all(bind=database.engine)
+def create_schema(connection):
+    # Building indexes or the marketplace view on existing data can take
+    # far longer than the per-statement timeout meant for requests
+    connection.execute(text("SET LOCAL statement_timeout = 0"))
+
+    # Create all database tables (if they don't exist)
+    # In a real production app, you'd use Alembic for migrations.
+    models.Base.metadata.create_all(bind=connection)
+
+    # create_all skips tables that already exist, so make sure indexes added
+    # after a table was first created are there too.
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+    for ddl in models.MARKETPLACE_VIEW_DDL:
+        connection.execute(text(ddl))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with database.engine.begin() as conn:
+        await conn.run_sync(create_schema)
+    async with database.SessionLocal() as db:
+        await crud.warm_statement_cache(db)
+    refresher = asyncio.create_task(crud.run_marketplace_refresher())
+    yield
+    refresher.cancel()
+    with suppress(asyncio.CancelledError):
+        await refresher
+    await database.engine.dispose()
+
 
 app = FastAPI(
     title="SlotSwapper API",
-    description="API for a peer-to-peer time slot exchange platform"
+    description="API for a peer-to-peer time slot exchange platform",
+    lifespan=lifespan
 )
 
+class ORJSONResponse(responses.ORJSONResponse):
+    """
+    FastAPI's ORJSONResponse, but writing UTC datetimes with a trailing
+    "Z" the way Pydantic does, so list and single-object endpoints format
+    the same fields identically.
+    """
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
 # --- CORS Configuration ---
 # Allow requests from your frontend
 origins = [
@@ -30,32 +75,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- Dependency ---
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 # ==================================
 # === AUTHENTICATION ENDPOINTS ===
 # ==================================
 
 @app.post("/auth/signup", response_model=schemas.Token)
-def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def signup(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_db)):
     """
     Create a new user and return a JWT token.
     """
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    new_user = crud.create_user(db, user)
+    new_user = await crud.create_user(db, user)
     
     # Create token
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -70,17 +106,26 @@ def signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
     }
 
 
-@app.post("/auth/login", response_model=schemas.Token)
-def login(
+@app.post(
+    "/auth/login",
+    response_model=schemas.Token
+)
+async def login(
+    request: Request,
     form_data: schemas.LoginRequest, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_db)
 ):
     """
     Authenticate user and return a JWT token.
     """
-    user = crud.get_user_by_email(db, email=form_data.email)
+    auth.check_login_rate_limit(request, form_data.email)
+    user = await crud.get_user_by_email(db, email=form_data.email)
     
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    # bcrypt is CPU-bound; keep it off the event loop
+    if not user or not await run_in_threadpool(
+        auth.authenticate_password, user, form_data.password
+    ):
+        auth.record_failed_login(request, form_data.email)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -99,7 +144,7 @@ def login(
     }
 
 @app.get("/users/me", response_model=schemas.User)
-def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
+async def read_users_me(current_user: schemas.User = Depends(auth.get_current_user_profile)):
     """
     Get the currently authenticated user's details.
     """
@@ -111,39 +156,48 @@ def read_users_me(current_user: models.User = Depends(auth.get_current_user)):
 # ==================================
 
 @app.post("/events", response_model=schemas.Event)
-def create_event(
+async def create_event(
     event: schemas.EventCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Create a new event for the logged-in user.
     """
-    return crud.create_event(db=db, event=event, user_id=current_user.id)
+    return await crud.create_event(db=db, event=event, user_id=current_user.id)
 
 
-@app.get("/events", response_model=List[schemas.Event])
-def get_my_events(
-    db: Session = Depends(get_db),
+# List endpoints return ORJSONResponse directly: response_model still
+# documents the shape, but the plain rows from crud are serialized as-is
+# instead of being validated through Pydantic first.
+@app.get(
+    "/events",
+    response_model=List[schemas.Event],
+    response_class=ORJSONResponse
+)
+async def get_my_events(
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Get all events for the logged-in user.
     """
-    return crud.get_events_by_user(db=db, user_id=current_user.id)
+    return ORJSONResponse(
+        await crud.get_events_by_user(db=db, user_id=current_user.id)
+    )
 
 
 @app.put("/events/{event_id}", response_model=schemas.Event)
-def update_event(
+async def update_event(
     event_id: int,
     event_data: schemas.EventUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Update an event's title, times, or status.
     """
-    db_event = crud.update_event(
+    db_event = await crud.update_event(
         db=db, 
         event_id=event_id, 
         event_data=event_data, 
@@ -155,15 +209,15 @@ def update_event(
 
 
 @app.delete("/events/{event_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_event(
+async def delete_event(
     event_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Delete an event owned by the logged-in user.
     """
-    db_event = crud.delete_event(db=db, event_id=event_id, user_id=current_user.id)
+    db_event = await crud.delete_event(db=db, event_id=event_id, user_id=current_user.id)
     if db_event is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Event not found")
     return {"ok": True}
@@ -173,15 +227,21 @@ def delete_event(
 # === MARKETPLACE ENDPOINTS ===
 # ==================================
 
-@app.get("/marketplace", response_model=List[schemas.MarketplaceSlot])
-def get_marketplace_slots(
-    db: Session = Depends(get_db),
+@app.get(
+    "/marketplace",
+    response_model=List[schemas.MarketplaceSlot],
+    response_class=ORJSONResponse
+)
+async def get_marketplace_slots(
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Get all swappable slots from *other* users.
     """
-    return crud.get_marketplace_slots(db=db, user_id=current_user.id)
+    return ORJSONResponse(
+        await crud.get_marketplace_slots(db=db, user_id=current_user.id)
+    )
 
 
 # ==================================
@@ -189,66 +249,71 @@ def get_marketplace_slots(
 # ==================================
 
 @app.post("/swap-requests", response_model=schemas.SwapRequestDetails)
-def create_swap_request(
+async def create_swap_request(
     request_data: schemas.SwapRequestCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Create a new swap request.
     """
-    db_request = crud.create_swap_request(
+    db_request, my_slot, their_slot, responder = await crud.create_swap_request(
         db=db, 
         request_data=request_data, 
         requester_id=current_user.id
     )
     
-    # We need to return the *detailed* schema, so we fetch it again
-    # This is less efficient but easier than constructing the detailed view
-    query = db.query(models.SwapRequest).filter(
-        models.SwapRequest.id == db_request.id
-    ).options(
-        joinedload(models.SwapRequest.requester),
-        joinedload(models.SwapRequest.responder),
-        joinedload(models.SwapRequest.my_slot),
-        joinedload(models.SwapRequest.their_slot)
+    # Everything the detailed schema needs is already in the session
+    return crud.build_swap_request_details(
+        db_request, current_user, responder, my_slot, their_slot
     )
-    return crud._get_swap_request_details(db, query)[0]
 
 
-@app.get("/swap-requests/incoming", response_model=List[schemas.SwapRequestDetails])
-def get_incoming_requests(
-    db: Session = Depends(get_db),
+@app.get(
+    "/swap-requests/incoming",
+    response_model=List[schemas.SwapRequestDetails],
+    response_class=ORJSONResponse
+)
+async def get_incoming_requests(
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Get all requests sent *to* the logged-in user.
     """
-    return crud.get_incoming_requests(db=db, user_id=current_user.id)
+    return ORJSONResponse(
+        await crud.get_incoming_requests(db=db, user_id=current_user.id)
+    )
 
 
-@app.get("/swap-requests/outgoing", response_model=List[schemas.SwapRequestDetails])
-def get_outgoing_requests(
-    db: Session = Depends(get_db),
+@app.get(
+    "/swap-requests/outgoing",
+    response_model=List[schemas.SwapRequestDetails],
+    response_class=ORJSONResponse
+)
+async def get_outgoing_requests(
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Get all requests sent *by* the logged-in user.
     """
-    return crud.get_outgoing_requests(db=db, user_id=current_user.id)
+    return ORJSONResponse(
+        await crud.get_outgoing_requests(db=db, user_id=current_user.id)
+    )
 
 
 @app.post("/swap-requests/{request_id}/respond")
-def respond_to_swap_request(
+async def respond_to_swap_request(
     request_id: int,
     response_data: schemas.SwapRespond,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     """
     Accept or reject an incoming swap request.
     """
-    db_request = crud.respond_to_swap_request(
+    db_request = await crud.respond_to_swap_request(
         db=db,
         request_id=request_id,
         accept=response_data.accept,
@@ -262,5 +327,5 @@ def respond_to_swap_request(
 
 # Root endpoint
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to the SlotSwapper API!"}
@@ -0,0 +1,30 @@
+"""
+Development entry point:
+
+    uvicorn backend.main_dev:app --reload --port 8000
+
+Same app as backend.main, but a lazy relationship load (e.g. touching
+event.owner or request.requester outside of an explicit load) raises a
+LazyLoadError naming the relationship. With AsyncSession such a load
+would fail anyway with an opaque MissingGreenlet; this turns it into an
+error that says what to fix.
+"""
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, Session
+from .main import app  # noqa: F401 (re-exported for uvicorn)
+
+
+class LazyLoadError(RuntimeError):
+    """Raised when a relationship is lazy-loaded in development."""
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _detect_lazy_load(orm_execute_state: ORMExecuteState) -> None:
+    if orm_execute_state.lazy_loaded_from is None:
+        return
+
+    raise LazyLoadError(
+        f"Lazy load of {orm_execute_state.loader_strategy_path} on "
+        f"{orm_execute_state.lazy_loaded_from.class_.__name__}; "
+        "load it explicitly in the query instead"
+    )
@@ -1,6 +1,7 @@
 import enum
 from sqlalchemy import (
-    Column, Integer, String, DateTime, ForeignKey, Enum, func
+    Column, Integer, String, DateTime, ForeignKey, Enum, Index, func, text,
+    column, table
 )
 from sqlalchemy.orm import relationship
 from .database import Base
@@ -51,6 +52,17 @@ class Event(Base):
     # Relationships
     owner = relationship("User", back_populates="events")
 
+    __table_args__ = (
+        # Dashboard: WHERE owner_id = ? ORDER BY start_time
+        Index("ix_events_owner_start", owner_id, start_time),
+        # Marketplace: WHERE status = 'SWAPPABLE' AND owner_id != ?
+        Index(
+            "ix_events_swappable_owner",
+            owner_id,
+            postgresql_where=text("status = 'SWAPPABLE'")
+        ),
+    )
+
 
 class SwapRequest(Base):
     __tablename__ = "swap_requests"
@@ -75,4 +87,41 @@ class SwapRequest(Base):
         "User", foreign_keys=[responder_id], back_populates="received_requests"
     )
     my_slot = relationship("Event", foreign_keys=[my_slot_id])
-    their_slot = relationship("Event", foreign_keys=[their_slot_id])
\ No newline at end of file
+    their_slot = relationship("Event", foreign_keys=[their_slot_id])
+
+    __table_args__ = (
+        # Incoming/outgoing lists: WHERE <side>_id = ? ORDER BY created_at DESC
+        Index("ix_swap_responder_created", responder_id, created_at.desc()),
+        Index("ix_swap_requester_created", requester_id, created_at.desc()),
+    )
+
+
+# --- Marketplace materialized view ---
+# Pre-joined feed of SWAPPABLE events and their owners' names. It is not a
+# mapped table (create_all must not create it); the DDL below is run at
+# startup and the view is refreshed whenever a slot's status changes.
+
+MARKETPLACE_VIEW_DDL = [
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS marketplace_slots AS
+    SELECT e.id, e.title, e.start_time, e.end_time, e.status, e.owner_id,
+           u.name AS owner_name
+    FROM events e
+    JOIN users u ON u.id = e.owner_id
+    WHERE e.status = 'SWAPPABLE'
+    """,
+    # REFRESH ... CONCURRENTLY requires a unique index
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_marketplace_slots_id ON marketplace_slots (id)",
+    "CREATE INDEX IF NOT EXISTS ix_marketplace_slots_owner ON marketplace_slots (owner_id)",
+]
+
+marketplace_slots = table(
+    "marketplace_slots",
+    column("id", Integer),
+    column("title", String),
+    column("start_time", DateTime(timezone=True)),
+    column("end_time", DateTime(timezone=True)),
+    column("status", Enum(EventStatus)),
+    column("owner_id", Integer),
+    column("owner_name", String),
+)
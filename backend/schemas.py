@@ -1,6 +1,7 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
 from typing import Optional
+from typing_extensions import TypedDict  # Pydantic needs this one before 3.12
 from .models import EventStatus, SwapStatus # Import enums from models
 
 # --- User Schemas ---
@@ -99,4 +100,38 @@ class SwapRequestDetails(BaseModel):
     their_slot_end: datetime
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# --- Fast-path row types ---
+# Plain dicts returned by the list endpoints' queries and serialized
+# straight to JSON, skipping Pydantic. They mirror the models above,
+# which remain the documented response_model for each endpoint.
+
+class EventRow(TypedDict):
+    id: int
+    title: str
+    start_time: datetime
+    end_time: datetime
+    status: EventStatus
+    owner_id: int
+
+class MarketplaceRow(EventRow):
+    owner_name: str
+
+class SwapRow(TypedDict):
+    id: int
+    status: SwapStatus
+    created_at: datetime
+    requester_id: int
+    requester_name: str
+    responder_id: int
+    responder_name: str
+    my_slot_id: int
+    my_slot_title: str
+    my_slot_start: datetime
+    my_slot_end: datetime
+    their_slot_id: int
+    their_slot_title: str
+    their_slot_start: datetime
+    their_slot_end: datetime